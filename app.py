@@ -1,18 +1,23 @@
 # -*- coding: utf-8 -*-
+import json
+import math
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
 from dotenv import load_dotenv
 
-import joblib
-import numpy as np
-from flask import Flask, request, render_template, redirect, url_for
+from flask import (Flask, Response, request, render_template, redirect,
+                   url_for, jsonify)
 from flask_login import (LoginManager, UserMixin, login_user,
                          logout_user, login_required, current_user)
 from werkzeug.security import generate_password_hash, check_password_hash
-import joblib
 from pymongo import MongoClient, DESCENDING
+from pymongo.errors import OperationFailure
 from pymongo.server_api import ServerApi
 import certifi
+from cachetools import TTLCache
 
 # ─── Load environment variables (.env file) ───────────────────────────────────
 load_dotenv()
@@ -20,22 +25,58 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "medipulse-secret-change-in-prod")
 
+# Pinned explicitly so a Werkzeug upgrade can't silently change it; scrypt is
+# memory-hard, which matters more for stored health-app credentials than the
+# ~100 ms it costs on /login. Hashes using any method still verify, since
+# check_password_hash reads the method from the stored hash itself.
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+
 # ─── MongoDB Atlas connection ─────────────────────────────────────────────────
 MONGO_URI = os.getenv("MONGO_URI")          # set in .env
-client     = MongoClient(
-    MONGO_URI,
-    server_api=ServerApi('1'),
-    tls=True,
-    tlsCAFile=certifi.where(),
-)
-db         = client["medipulse"]            # database name
-users_col  = db["users"]                    # collection: users
-history_col= db["history"]                  # collection: history
+
+# Per-worker concurrency that can be talking to Mongo at once: gunicorn's
+# request threads plus the background history writers (see _io_pool).
+REQUEST_THREADS = int(os.getenv("GUNICORN_THREADS", 4))
+HISTORY_WRITERS = 4
+
+def connect_mongo():
+    """(Re)create the client and collection handles.
+
+    Called at import and again in each gunicorn worker after fork, since a
+    MongoClient must not be shared across a fork (see gunicorn_conf.py).
+    """
+    global client, db, users_col, history_col
+    client     = MongoClient(
+        MONGO_URI,
+        server_api=ServerApi('1'),
+        tls=True,
+        tlsCAFile=certifi.where(),
+        # The pool is per gunicorn worker, so size it to what one worker can
+        # actually have in flight; keep one warm connection so the first
+        # request after idle doesn't pay a fresh TLS handshake to Atlas.
+        # Write concern is left to the URI (w=majority on Atlas).
+        maxPoolSize=REQUEST_THREADS + HISTORY_WRITERS,
+        minPoolSize=1,
+        maxIdleTimeMS=300_000,
+        retryWrites=True,
+        compressors="zstd,zlib",
+    )
+    db         = client["medipulse"]            # database name
+    users_col  = db["users"]                    # collection: users
+    history_col= db["history"]                  # collection: history
+
+connect_mongo()
 
 # Ensure unique index on username
 users_col.create_index("username", unique=True)
-# Ensure index on history for fast per-user queries
-history_col.create_index([("username", 1), ("timestamp", DESCENDING)])
+# Ensure index matching get_history's filter + sort, so Mongo never has to
+# sort in memory. The old ("username", "timestamp") index sorted on a display
+# string that get_history doesn't use, so drop it if it's still around.
+history_col.create_index([("username", 1), ("created_at", DESCENDING)])
+try:
+    history_col.drop_index([("username", 1), ("timestamp", DESCENDING)])
+except OperationFailure:
+    pass
 
 # ─── Flask-Login ──────────────────────────────────────────────────────────────
 login_manager = LoginManager(app)
@@ -49,23 +90,41 @@ class User(UserMixin):
         self.id = username
         self.username = username
 
+# Flask-Login calls load_user on every authenticated request; remember users
+# we've already confirmed so that isn't a Mongo round-trip each time.
+_user_cache      = TTLCache(maxsize=10_000, ttl=300)
+_user_cache_lock = threading.Lock()             # TTLCache isn't thread-safe
+
 @login_manager.user_loader
 def load_user(user_id):
-    doc = users_col.find_one({"username": user_id})
-    if doc:
-        return User(user_id)
+    with _user_cache_lock:
+        user = _user_cache.get(user_id)
+    if user is not None:
+        return user
+    if get_user_exists(user_id):
+        user = User(user_id)
+        with _user_cache_lock:
+            _user_cache[user_id] = user
+        return user
     return None
 
 # ─── User helpers ─────────────────────────────────────────────────────────────
 def get_user(username):
-    return users_col.find_one({"username": username})
+    """Fetch just the password hash; only /login needs the document."""
+    return users_col.find_one({"username": username}, {"password": 1, "_id": 0})
 
-def create_user(username, password):
-    users_col.insert_one({
+def get_user_exists(username):
+    return users_col.count_documents({"username": username}, limit=1) > 0
+
+def new_user_doc(username, password):
+    return {
         "username": username,
-        "password": generate_password_hash(password),
+        "password": generate_password_hash(password, method=PASSWORD_HASH_METHOD),
         "created_at": datetime.utcnow(),
-    })
+    }
+
+def create_user(username, password):
+    users_col.insert_one(new_user_doc(username, password))
 
 # ─── Seed default accounts (lazily) ──────────────────────────────────────────
 _seeded = False
@@ -75,8 +134,12 @@ def seed_if_needed():
         try:
             if users_col.count_documents({}, limit=1) == 0:
                 print("Seeding default accounts...")
-                create_user("admin",  "admin123")
-                create_user("doctor", "doctor123")
+                # One round-trip for both accounts; unordered so a duplicate
+                # from a concurrently seeding worker doesn't block the other.
+                users_col.insert_many([
+                    new_user_doc("admin",  "admin123"),
+                    new_user_doc("doctor", "doctor123"),
+                ], ordered=False)
             _seeded = True
         except Exception as e:
             print(f"⚠️ MongoDB Seed Warning: {e}")
@@ -86,17 +149,32 @@ def check_seed():
     seed_if_needed()
 
 # ─── History helpers ──────────────────────────────────────────────────────────
-def add_to_history(username, inputs, result, result_type, probability):
+def add_to_history(username, inputs, result, result_type, probability,
+                   created_at=None):
+    # created_at is the only timestamp stored; history.html formats it.
     history_col.insert_one({
         "username":    username,
-        "timestamp":   datetime.now().strftime("%d %b %Y, %I:%M %p"),
         "inputs":      inputs,
         "result":      result,
         "result_type": result_type,
         "probability": probability,
-        "created_at":  datetime.utcnow(),
+        "created_at":  created_at or datetime.utcnow(),
     })
 
+# History writes run off the request thread so /predict doesn't wait on an
+# Atlas round-trip. Threads start lazily, i.e. inside each gunicorn worker.
+_io_pool = ThreadPoolExecutor(max_workers=HISTORY_WRITERS, thread_name_prefix="history")
+
+def _log_write_error(future):
+    e = future.exception()
+    if e is not None:
+        print(f"⚠️ MongoDB History Warning: {e}")
+
+def add_to_history_async(**record):
+    """Queue add_to_history(); created_at is taken now, not when it runs."""
+    record.setdefault("created_at", datetime.utcnow())
+    _io_pool.submit(add_to_history, **record).add_done_callback(_log_write_error)
+
 def get_history(username, limit=50):
     cursor = history_col.find(
         {"username": username},
@@ -108,10 +186,70 @@ def clear_user_history(username):
     history_col.delete_many({"username": username})
 
 # ─── ML model & preprocessors ────────────────────────────────────────────────
-model = joblib.load(os.path.join(BASE_DIR, "model.pkl"))
-le_gen   = joblib.load(os.path.join(BASE_DIR, "le_gender.pkl"))
-le_smoke = joblib.load(os.path.join(BASE_DIR, "le_smoking.pkl"))
-scaler   = joblib.load(os.path.join(BASE_DIR, "scaler.pkl"))
+# Weights and label sets are exported from the .pkl artifacts by
+# export_model.py, so workers boot without importing sklearn or NumPy.
+with open(os.path.join(BASE_DIR, "model_params.json"), encoding="utf-8") as f:
+    _params = json.load(f)
+
+# LabelEncoder.transform is a sorted search over classes_; for 3–6 labels a
+# dict lookup does the same job without the per-call array round-trip.
+GENDER_MAP = {c: i for i, c in enumerate(_params["gender_classes"])}
+SMOKE_MAP  = {c: i for i, c in enumerate(_params["smoking_classes"])}
+
+# LogisticRegression is just sigmoid(x·w + b). With only 8 features, plain
+# Python floats beat building a NumPy array per request.
+_coef      = tuple(_params["coef"])
+_intercept = _params["intercept"]
+
+def predict_proba(features):
+    """Positive-class probability for one row of 8 raw features."""
+    z = _intercept + sum(w * x for w, x in zip(_coef, features))
+    if z >= 0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)                         # avoids overflow for very negative z
+    return e / (1.0 + e)
+
+# Same inputs always give the same score, so memoize on the encoded feature
+# tuple. Clear with infer.cache_clear() if the model is ever reloaded.
+@lru_cache(maxsize=4096)
+def infer(gender_enc, age, hypertension, heart_disease,
+          smoking_enc, bmi, hba1c, glucose):
+    features = (gender_enc, age, hypertension, heart_disease,
+                smoking_enc, bmi, hba1c, glucose)
+    return round(predict_proba(features) * 100, 1)
+
+# ─── /predict form validation ────────────────────────────────────────────────
+# (form field, converter, allowed range or label set) — mirrors index.html.
+PREDICT_FIELDS = [
+    ("gender",              str,   GENDER_MAP),
+    ("age",                 float, (1, 120)),
+    ("hypertension",        int,   (0, 1)),
+    ("heart_disease",       int,   (0, 1)),
+    ("smoking_history",     str,   SMOKE_MAP),
+    ("bmi",                 float, (10, 70)),
+    ("HbA1c_level",         float, (3, 15)),
+    ("blood_glucose_level", float, (50, 400)),
+]
+
+def parse_predict_form(form):
+    """Return (values, None) on success or (None, error message) on the
+    first missing, malformed or out-of-range field."""
+    values = {}
+    for field, conv, allowed in PREDICT_FIELDS:
+        raw = form.get(field)
+        if raw is None or raw == "":
+            return None, f"Missing field: {field}"
+        try:
+            value = conv(raw)
+        except ValueError:
+            return None, f"Invalid value for {field}: {raw!r}"
+        if isinstance(allowed, dict):
+            if value not in allowed:
+                return None, f"Invalid value for {field}: {raw!r}"
+        elif not allowed[0] <= value <= allowed[1]:
+            return None, f"{field} must be between {allowed[0]} and {allowed[1]}"
+        values[field] = value
+    return values, None
 
 # ─── Auth routes ─────────────────────────────────────────────────────────────
 @app.route("/login", methods=["GET", "POST"])
@@ -146,7 +284,7 @@ def register():
             error = "Password must be at least 6 characters."
         elif password != password2:
             error = "Passwords do not match."
-        elif get_user(username):
+        elif get_user_exists(username):
             error = f"Username '{username}' is already taken."
         else:
             create_user(username, password)
@@ -174,73 +312,90 @@ def clear_history():
     return redirect(url_for("history"))
 
 # ─── Main routes ─────────────────────────────────────────────────────────────
+# The signed-out home page has no per-request content, so render it once and
+# serve the bytes. Signed-in users see their name in the nav and still get a
+# fresh render; debug / template auto-reload skips the cache entirely.
+_index_html = None
+
 @app.route("/")
 def home():
-    return render_template("index.html")
+    global _index_html
+    if current_user.is_authenticated or app.jinja_env.auto_reload:
+        return render_template("index.html")
+    if _index_html is None:
+        _index_html = render_template("index.html").encode("utf-8")
+    return Response(_index_html, mimetype="text/html")
 
-@app.route("/predict", methods=["POST"])
-def predict():
-    try:
-        gender          = request.form["gender"]
-        age             = float(request.form["age"])
-        hypertension    = int(request.form["hypertension"])
-        heart_disease   = int(request.form["heart_disease"])
-        smoking_history = request.form["smoking_history"]
-        bmi             = float(request.form["bmi"])
-        hba1c           = float(request.form["HbA1c_level"])
-        glucose         = float(request.form["blood_glucose_level"])
-
-        gender_enc  = le_gen.transform([gender])[0]
-        smoking_enc = le_smoke.transform([smoking_history])[0]
-
-        raw        = np.array([[gender_enc, age, hypertension, heart_disease,
-                                smoking_enc, bmi, hba1c, glucose]])
-        
-        # Scikit-learn LogisticRegression returns [[prob_negative, prob_positive]]
-        # Pass raw unscaled data since the model expects it based on its intercept
-        prediction_proba = model.predict_proba(raw)
-        probability = round(float(prediction_proba[0][1]) * 100, 1)
-
-        result_type = "diabetic" if probability >= 50 else "not_diabetic"
-        result      = ("⚠️ High Diabetes Risk Detected"
-                       if probability >= 50 else "✅ Low Diabetes Risk")
-
-        # Save to MongoDB if logged in
-        if current_user.is_authenticated:
-            add_to_history(
-                username    = current_user.username,
-                inputs      = {
-                    "Gender":          gender,
-                    "Age":             age,
-                    "Hypertension":    "Yes" if hypertension else "No",
-                    "Heart Disease":   "Yes" if heart_disease else "No",
-                    "Smoking History": smoking_history,
-                    "BMI":             bmi,
-                    "HbA1c Level":     hba1c,
-                    "Blood Glucose":   glucose,
-                },
-                result      = result,
-                result_type = result_type,
-                probability = probability,
-            )
+def run_prediction(values):
+    """Score validated form values and log them for signed-in users.
 
-        return render_template("index.html",
-                               prediction_text=result,
-                               result_type=result_type,
-                               probability=probability)
+    Returns (result, result_type, probability).
+    """
+    gender          = values["gender"]
+    age             = values["age"]
+    hypertension    = values["hypertension"]
+    heart_disease   = values["heart_disease"]
+    smoking_history = values["smoking_history"]
+    bmi             = values["bmi"]
+    hba1c           = values["HbA1c_level"]
+    glucose         = values["blood_glucose_level"]
 
-    except KeyError as e:
-        return render_template("index.html",
-                               prediction_text=f"❌ Missing field: {e}",
-                               result_type="error"), 400
-    except ValueError as e:
+    gender_enc  = GENDER_MAP[gender]
+    smoking_enc = SMOKE_MAP[smoking_history]
+
+    # Pass raw unscaled data since the model expects it based on its intercept.
+    # BMI/HbA1c are quantized to the form's input step to widen cache hits.
+    probability = infer(gender_enc, age, hypertension, heart_disease,
+                        smoking_enc, round(bmi, 2), round(hba1c, 1), glucose)
+
+    result_type = "diabetic" if probability >= 50 else "not_diabetic"
+    result      = ("⚠️ High Diabetes Risk Detected"
+                   if probability >= 50 else "✅ Low Diabetes Risk")
+
+    # Save to MongoDB if logged in
+    if current_user.is_authenticated:
+        add_to_history_async(
+            username    = current_user.username,
+            inputs      = {
+                "Gender":          gender,
+                "Age":             age,
+                "Hypertension":    "Yes" if hypertension else "No",
+                "Heart Disease":   "Yes" if heart_disease else "No",
+                "Smoking History": smoking_history,
+                "BMI":             bmi,
+                "HbA1c Level":     hba1c,
+                "Blood Glucose":   glucose,
+            },
+            result      = result,
+            result_type = result_type,
+            probability = probability,
+        )
+
+    return result, result_type, probability
+
+@app.route("/predict", methods=["POST"])
+def predict():
+    values, error = parse_predict_form(request.form)
+    if error:
         return render_template("index.html",
-                               prediction_text=f"❌ Invalid value: {e}",
+                               prediction_text=f"❌ {error}",
                                result_type="error"), 400
-    except Exception:
-        return render_template("index.html",
-                               prediction_text="❌ An unexpected error occurred.",
-                               result_type="error"), 500
+    result, result_type, probability = run_prediction(values)
+    return render_template("index.html",
+                           prediction_text=result,
+                           result_type=result_type,
+                           probability=probability)
+
+@app.route("/api/predict", methods=["POST"])
+def api_predict():
+    """JSON twin of /predict; index.html posts here and patches the page."""
+    values, error = parse_predict_form(request.form)
+    if error:
+        return jsonify({"result_type": "error", "error": error}), 400
+    result, result_type, probability = run_prediction(values)
+    return jsonify({"result":      result,
+                    "result_type": result_type,
+                    "probability": probability})
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 10000)))
\ No newline at end of file
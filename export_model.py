@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Export the trained model + label encoders to model_params.json.
+
+app.py only reads the JSON, so serving needs neither scikit-learn nor NumPy.
+Re-run this whenever model.pkl / le_*.pkl change:
+
+    pip install scikit-learn==1.6.1 joblib==1.3.2
+    python export_model.py
+"""
+import json
+import os
+
+import joblib
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def export_params():
+    model    = joblib.load(os.path.join(BASE_DIR, "model.pkl"))
+    le_gen   = joblib.load(os.path.join(BASE_DIR, "le_gender.pkl"))
+    le_smoke = joblib.load(os.path.join(BASE_DIR, "le_smoking.pkl"))
+    return {
+        # Feature order: gender, age, hypertension, heart_disease,
+        # smoking_history, bmi, HbA1c_level, blood_glucose_level
+        "coef":            [float(w) for w in model.coef_[0]],
+        "intercept":       float(model.intercept_[0]),
+        "gender_classes":  [str(c) for c in le_gen.classes_],
+        "smoking_classes": [str(c) for c in le_smoke.classes_],
+    }
+
+if __name__ == "__main__":
+    path = os.path.join(BASE_DIR, "model_params.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(export_params(), f, indent=2)
+        f.write("\n")
+    print(f"Wrote {path}")
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# gunicorn settings: gunicorn -c gunicorn_conf.py app:app
+import multiprocessing
+import os
+
+bind         = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers      = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads      = int(os.getenv("GUNICORN_THREADS", 4))
+timeout      = 120
+
+# Import app.py (model + preprocessors) once in the master; workers share it
+# copy-on-write instead of each loading it again.
+preload_app  = True
+
+def when_ready(server):
+    # The master only needed Mongo to create indexes while importing the
+    # app; close that client so it doesn't hold connections and monitor
+    # threads for the server's lifetime.
+    import app
+    app.client.close()
+
+def post_fork(server, worker):
+    # pymongo is not fork-safe: the client opened in the master at import
+    # must not be reused, so each worker builds its own connection pool.
+    import app
+    app.connect_mongo()